@@ -0,0 +1,153 @@
+import os
+import asyncio
+import threading
+import multiprocessing
+import weakref
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
+from app import orchestrator, metrics  # shared caches and stage timers
+from app import qkd
+from app.storage import load_record, submit_save_patients, submit_unlock_patients, flush_writes  # storage functions
+from app.ml_model import predict as predict_patient_risk, get_model_bundle  # ml functions
+
+CPU_WORKERS = int(os.environ.get("QSH_ASYNC_CPU_WORKERS", str(os.cpu_count() or 1)))  # processes for bb84, shamir and training
+IO_WORKERS = int(os.environ.get("QSH_ASYNC_IO_WORKERS", "16"))  # threads for storage, aes-gcm and model loading
+MAX_CONCURRENCY = int(os.environ.get("QSH_ASYNC_MAX_CONCURRENCY", "64"))  # requests in flight per event loop
+
+_pools = {"cpu": None, "io": None}  # lazily created executors
+_pools_lock = threading.Lock()
+_limits = weakref.WeakKeyDictionary()  # event loop -> request semaphore
+
+def configure(cpu_workers: Optional[int] = None, io_workers: Optional[int] = None, max_concurrency: Optional[int] = None):  # change limits, existing pools are replaced on next use
+    global CPU_WORKERS, IO_WORKERS, MAX_CONCURRENCY
+    shutdown()
+    CPU_WORKERS = cpu_workers or CPU_WORKERS
+    IO_WORKERS = io_workers or IO_WORKERS
+    MAX_CONCURRENCY = max_concurrency or MAX_CONCURRENCY
+    _limits.clear()
+
+def shutdown(wait: bool = True):  # stop both executors
+    with _pools_lock:
+        for name, pool in _pools.items():
+            if pool is not None:
+                pool.shutdown(wait=wait)
+            _pools[name] = None
+
+def _cpu_pool() -> ProcessPoolExecutor:
+    with _pools_lock:
+        if _pools["cpu"] is None:
+            ctx = multiprocessing.get_context("spawn")  # forking would copy the storage writer and key pool threads mid state
+            _pools["cpu"] = ProcessPoolExecutor(max_workers=CPU_WORKERS, mp_context=ctx)
+        return _pools["cpu"]
+
+def _io_pool() -> ThreadPoolExecutor:
+    with _pools_lock:
+        if _pools["io"] is None:
+            _pools["io"] = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="qsh-async-io")
+        return _pools["io"]
+
+def _limit() -> asyncio.Semaphore:  # request semaphore of the running loop
+    loop = asyncio.get_running_loop()
+    sem = _limits.get(loop)
+    if sem is None:
+        sem = _limits[loop] = asyncio.Semaphore(MAX_CONCURRENCY)
+    return sem
+
+async def _cpu(fn, *args):  # run picklable cpu bound work in the process pool
+    return await asyncio.get_running_loop().run_in_executor(_cpu_pool(), fn, *args)
+
+async def _io(fn, *args):  # run blocking io or aes work in the thread pool
+    return await asyncio.get_running_loop().run_in_executor(_io_pool(), fn, *args)
+
+def _key_material(key_hex, num_shares, threshold):  # worker side bb84 key, shamir shares and share check
+    from app.smpc import share_secret  # local import, runs in the worker process
+    from app.detector import detect_attack
+    if key_hex is None:
+        key_hex = qkd.generate_qkd_key()
+    shares = share_secret(key_hex, num_shares, threshold)
+    return key_hex, shares, detect_attack(shares)
+
+def _train_worker():  # worker side training, the parent picks the new model up from its file stamp
+    from app import feature_store  # local import, runs in the worker process
+    from app.ml_model import train_model
+    feature_store.READ_ONLY = True  # the parent keeps appending, compacting here would drop its rows
+    return train_model()
+
+async def aregister_patient(pid, name, age, condition, bp, chol, num_shares=5, threshold=3):  # async register patient flow
+    try:
+        async with _limit():
+            with metrics.timer("async.register"):
+                if await _io(load_record, pid):
+                    return {"error": "already registered"}  # cheap early exit, the writer repeats the check atomically
+                if threshold > num_shares:
+                    return {"error": "threshold cannot be greater than total shares"}  # threshold invalid
+                key_hex = await _io(qkd.generate_qkd_key) if qkd._key_pool is not None else None  # a running key pool lives in this process
+                key_hex, shares, attack_detected = await _cpu(_key_material, key_hex, num_shares, threshold)
+                patient = {"patient_id": pid, "name": name, "age": age, "condition": condition, "blood_pressure": bp, "cholesterol": chol, "key_hex": key_hex}
+                future = await _io(submit_save_patients, [(pid, patient, key_hex, shares, threshold)], True)  # encrypts on the io thread
+                if not await asyncio.wrap_future(future):  # resolves when the group commit lands
+                    return {"error": "already registered"}  # another request registered this pid first
+                orchestrator._unlocked_keys_cache[pid] = key_hex  # cache key for demo use
+                orchestrator._unlocked_patients_cache[pid] = patient  # cache patient
+                return {"ok": True, "patient_id": pid, "key_hex_for_demo": key_hex, "threshold": threshold, "attack_detected": attack_detected}
+    except Exception as e:
+        return {"error": str(e) or "Unknown error"}
+
+async def areconstruct_key(pid, num_shares):  # async key reconstruction
+    async with _limit():
+        return await _io(orchestrator.reconstruct_key_wrapper, pid, num_shares)
+
+async def aunlock_patient(pid, key_hex):  # async unlock using the shared cache
+    try:
+        cached_key = orchestrator._unlocked_keys_cache.get(pid)
+        patient = orchestrator._unlocked_patients_cache.get(pid) if cached_key == key_hex else None
+        if patient is not None:
+            metrics.inc("unlock.cache_hit")
+            return {"ok": True, "patient": patient}  # return cached patient
+        metrics.inc("unlock.cache_miss")
+        async with _limit():
+            with metrics.timer("async.unlock"):
+                future = await _io(submit_unlock_patients, [(pid, key_hex)])  # decrypts on the io thread
+                res = (await asyncio.wrap_future(future))[pid]
+        if res.get("ok"):
+            orchestrator._unlocked_keys_cache[pid] = key_hex
+            orchestrator._unlocked_patients_cache[pid] = res["patient"]
+        return res
+    except Exception as e:
+        return {"ok": False, "error": str(e) or "Unlock failed"}
+
+async def apredict_risk(pid, key_hex=None):  # async predict risk for pid
+    try:
+        if key_hex:
+            unlocked = await aunlock_patient(pid, key_hex)
+            if not unlocked.get("ok"):
+                return {"ok": False, "error": "Invalid key or patient not found"}
+            patient = unlocked["patient"]
+        else:
+            patient = orchestrator._unlocked_patients_cache.get(pid)
+            if not patient:
+                return {"ok": False, "error": "Patient not unlocked and no key provided"}
+        async with _limit():
+            with metrics.timer("async.predict"):
+                return await _io(predict_patient_risk, patient)  # may load the model file
+    except Exception as e:
+        return {"ok": False, "error": str(e) or "Prediction failed"}
+
+async def apredict_many(items, keys=None, from_store=False):  # async batch prediction
+    async with _limit():
+        return await _io(orchestrator.predict_many, items, keys, from_store)
+
+async def atrain_model():  # async training in a worker process
+    try:
+        async with _limit():
+            with metrics.timer("async.train"):
+                await _io(flush_writes)  # the worker reads the stores from disk, so queued writes must land first
+                result = await _cpu(_train_worker)
+                await _io(get_model_bundle)  # load the new model here before the next prediction needs it
+                return result
+    except Exception as e:
+        return {"error": str(e) or "Model training failed"}
+
+async def adelete_patient(pid):  # async delete
+    async with _limit():
+        return await _io(orchestrator.delete_patient_wrapper, pid)
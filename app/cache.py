@@ -0,0 +1,115 @@
+import sys
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+_MISSING = object()
+
+def approx_size(value: Any) -> int:  # shallow byte estimate of a cached value, one level into dicts lists and tuples
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(sys.getsizeof(v) for v in value)
+    return size
+
+class BoundedCache:  # thread safe lru cache with entry and byte budgets and per entry ttl
+    def __init__(self, max_entries: Optional[int] = 10000, max_bytes: Optional[int] = None, ttl: Optional[float] = None, sizer: Callable[[Any], int] = approx_size, name: str = "cache"):
+        self.max_entries = max_entries  # none means unlimited
+        self.max_bytes = max_bytes  # none means unlimited
+        self.ttl = ttl  # seconds an entry lives after it was stored, none means forever
+        self.name = name
+        self._sizer = sizer
+        self._data: "OrderedDict[Any, tuple]" = OrderedDict()  # key -> (value, size, expires_at), oldest use first
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self._next_purge = 0.0  # monotonic time of the next full expiry sweep
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    def _drop(self, key):  # remove one entry and its bytes, lock held
+        _, size, _ = self._data.pop(key)
+        self._bytes -= size
+
+    def _expired(self, expires_at: Optional[float], now: float) -> bool:
+        return expires_at is not None and now >= expires_at
+
+    def purge_expired(self) -> int:  # drop every expired entry now
+        with self._lock:
+            now = time.monotonic()
+            stale = [k for k, (_, _, exp) in self._data.items() if self._expired(exp, now)]
+            for key in stale:
+                self._drop(key)
+            self._stats["expirations"] += len(stale)
+            if self.ttl is not None:
+                self._next_purge = now + self.ttl / 4
+            return len(stale)
+
+    def get(self, key, default=None):  # value for key, refreshing its lru position
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                self._stats["misses"] += 1
+                return default
+            if self._expired(item[2], time.monotonic()):
+                self._drop(key)
+                self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+                return default
+            self._data.move_to_end(key)
+            self._stats["hits"] += 1
+            return item[0]
+
+    def put(self, key, value):  # store value and evict least recently used entries over budget
+        size = self._sizer(value) if self.max_bytes is not None else 0
+        with self._lock:
+            now = time.monotonic()
+            if self.ttl is not None and now >= self._next_purge:
+                self.purge_expired()  # amortised sweep so unread entries do not outlive their ttl for long
+            if key in self._data:
+                self._drop(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return  # larger than the whole budget, never cached
+            self._data[key] = (value, size, None if self.ttl is None else now + self.ttl)
+            self._bytes += size
+            while (self.max_entries is not None and len(self._data) > self.max_entries) or (self.max_bytes is not None and self._bytes > self.max_bytes):
+                self._drop(next(iter(self._data)))
+                self._stats["evictions"] += 1
+
+    def pop(self, key, default=None):  # remove key and return its value
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                return default
+            self._drop(key)
+            return default if self._expired(item[2], time.monotonic()) else item[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def __contains__(self, key) -> bool:  # live membership test, does not touch stats or lru order
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            return item is not _MISSING and not self._expired(item[2], time.monotonic())
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __setitem__(self, key, value):
+        self.put(key, value)
+
+    def stats(self) -> Dict[str, Any]:  # hit, miss, eviction and expiry counts plus current size
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                "name": self.name,
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                **self._stats,
+                "hit_rate": round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+            }
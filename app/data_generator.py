@@ -1,3 +1,6 @@
+import numpy as np
+from app.ml_model import HIGH_RISK_DISEASES, MEDIUM_RISK_DISEASES, LOW_RISK_DISEASES  # condition sets used for labels
+
 def input_patient_data(patient_id: str):  # interactive data input for a patient
     name = input("Name ")  # patient name
     age = int(input("Age "))  # patient age
@@ -12,3 +15,53 @@ def input_patient_data(patient_id: str):  # interactive data input for a patient
         "blood_pressure": blood_pressure,
         "cholesterol": cholesterol
     }  # return patient dict
+
+CONDITION_WEIGHTS = {"low": 0.40, "medium": 0.35, "high": 0.25}  # share of each risk tier in a synthetic cohort
+TIER_PROFILES = {  # (mean, std) of age, systolic, diastolic and cholesterol per risk tier
+    "low": {"age": (35, 10), "systolic": (118, 8), "diastolic": (77, 6), "cholesterol": (175, 20)},
+    "medium": {"age": (45, 12), "systolic": (132, 10), "diastolic": (85, 7), "cholesterol": (210, 25)},
+    "high": {"age": (58, 11), "systolic": (150, 12), "diastolic": (95, 8), "cholesterol": (245, 30)},
+}
+LIMITS = {"age": (18, 95), "systolic": (90, 210), "diastolic": (55, 130), "cholesterol": (110, 400)}  # clip range of each field
+
+def _display_name(condition: str) -> str:  # condition label as the ui shows it
+    return condition.upper() if condition == "ckd" else condition.title()
+
+def _tier_conditions():  # conditions of each risk tier taken from the model rule sets
+    return {
+        "low": sorted(c for c in LOW_RISK_DISEASES if c != "none"),
+        "medium": sorted(MEDIUM_RISK_DISEASES),
+        "high": sorted(HIGH_RISK_DISEASES),
+    }
+
+def generate_patients(n: int, seed=None, prefix: str = "S", start: int = 0, block: int = 10000):  # lazily yield (pid, name, age, condition, bp, chol) rows
+    rng = np.random.default_rng(seed)
+    tiers = list(CONDITION_WEIGHTS)
+    conditions = _tier_conditions()
+    weights = np.array([CONDITION_WEIGHTS[t] for t in tiers])
+    for offset in range(0, n, block):
+        size = block  # always draw whole blocks so a shorter cohort is a prefix of a longer one with the same seed
+        tier_idx = rng.choice(len(tiers), size=size, p=weights / weights.sum())
+        fields = {}
+        for field, (low, high) in LIMITS.items():
+            mean = np.array([TIER_PROFILES[t][field][0] for t in tiers])[tier_idx]
+            std = np.array([TIER_PROFILES[t][field][1] for t in tiers])[tier_idx]
+            fields[field] = np.clip(np.rint(rng.normal(mean, std)), low, high).astype(int)
+        fields["diastolic"] = np.minimum(fields["diastolic"], fields["systolic"] - 20)  # keep a plausible pulse pressure
+        picks = rng.random(size)
+        for i in range(min(block, n - offset)):
+            number = start + offset + i
+            options = conditions[tiers[tier_idx[i]]]
+            condition = _display_name(options[int(picks[i] * len(options))])
+            bp = f"{fields['systolic'][i]} {fields['diastolic'][i]}"
+            yield (f"{prefix}{number}", f"Patient{number}", int(fields["age"][i]), condition, bp, int(fields["cholesterol"][i]))
+
+def chunked(rows, size: int = 1000):  # group a row stream into lists for batch registration
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
@@ -1,27 +1,15 @@
 # debug_decrypt.py
-import sys, os, json
+import sys
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
-
-DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
-RECORDS = os.path.join(DATA_DIR, "records.json")
-
-def _load_json(path):
-    if not os.path.exists(path):
-        return {}
-    with open(path, "r", encoding="utf-8") as f:
-        try:
-            return json.load(f)
-        except:
-            return {}
+from app.storage import load_record
 
 def debug(pid, key_hex):
-    recs = _load_json(RECORDS)
-    if pid not in recs:
+    blob = load_record(pid)
+    if not blob:
         print("No record for", pid)
         return
-    blob = recs[pid]
-    nonce = bytes.fromhex(blob["nonce_hex"])
-    ct = bytes.fromhex(blob["ciphertext_hex"])
+    nonce = blob["nonce"]
+    ct = blob["ciphertext"]
     key = bytes.fromhex(key_hex)
     try:
         pt = AESGCM(key).decrypt(nonce, ct, None)
@@ -1,11 +1,42 @@
 import numpy as np
 import hashlib
 import json
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from app.qkd import simulate_qber_batch
+from app.storage import iter_packed_shares
+
+QBER_SECURE_THRESHOLD = 0.11  # below this the channel is considered secure
+QBER_ALERT_THRESHOLD = 0.20  # at or above this an eavesdropper is reported
+SHARE_PRIME = 257  # field of the shamir shares from app.smpc
+SKEW_Z_LIMIT = 6.0  # z score of the mean share value beyond which shares are not uniform
+
+def _share_flags(xs, vals, thresholds=None):  # vectorized tamper checks for P patients with n shares of L values, returns name to bool array
+    patients, count, length = vals.shape
+    flags = {
+        "bad_x": ((xs <= 0) | (xs >= SHARE_PRIME)).any(axis=1),
+        "duplicate_x": (np.diff(np.sort(xs, axis=1), axis=1) == 0).any(axis=1),
+        "out_of_range": ((vals < 0) | (vals >= SHARE_PRIME)).any(axis=(1, 2)),
+        "constant_share": (vals.max(axis=2) == vals.min(axis=2)).any(axis=1),
+    }
+    rows = np.sort(np.ascontiguousarray(vals.astype("<u2")).view(np.dtype((np.void, 2 * length))).reshape(patients, count), axis=1)
+    flags["duplicate_share"] = (rows[:, 1:] == rows[:, :-1]).any(axis=1)
+    expected_std = np.sqrt((SHARE_PRIME ** 2 - 1) / 12.0) / np.sqrt(count * length)  # std of the mean of uniform values
+    flags["skewed_values"] = np.abs(vals.mean(axis=(1, 2)) - (SHARE_PRIME - 1) / 2.0) / expected_std > SKEW_Z_LIMIT
+    if thresholds is not None:
+        flags["too_few_shares"] = count < np.asarray(thresholds)
+    return flags
 
 def detect_attack(shares):  # simple tamper detection for shares
     try:
         if not shares or not isinstance(shares, list):
             return True  # invalid shares indicate attack
+        if all(isinstance(s, dict) for s in shares):  # share dicts from app.smpc
+            if len({len(s["share"]) for s in shares}) != 1 or len(shares[0]["share"]) < 2:
+                return True  # ragged or empty shares
+            xs = np.array([[int(s["x"]) for s in shares]], dtype=np.int64)
+            vals = np.array([[s["share"] for s in shares]], dtype=np.int64)
+            return bool(any(flag[0] for flag in _share_flags(xs, vals).values()))
         unique_hashes = {hashlib.sha256(str(s).encode()).hexdigest() for s in shares}  # hash each share
         if len(unique_hashes) != len(shares):
             return True  # duplicate share detected
@@ -24,11 +55,86 @@ def detect_attack(shares):  # simple tamper detection for shares
 
 def analyze_qber(qber):  # analyze qber value
     try:
-        if qber < 0.11:
+        if qber < QBER_SECURE_THRESHOLD:
             return {"ok": True, "message": f"QBER {qber:.4f} secure"}
-        elif qber < 0.20:
+        elif qber < QBER_ALERT_THRESHOLD:
             return {"ok": True, "message": f"QBER {qber:.4f} mild noise"}
         else:
             return {"ok": False, "message": f"QBER {qber:.4f} high error possible eavesdrop"}
     except Exception:
         return {"ok": False, "message": "Failed to analyze QBER"}
+
+def _sweep_cell(args):  # simulate one (eve_rate, key_size) grid cell
+    eve_rate, key_size, rounds, seed = args
+    n_qubits = max(4 * key_size, 1024)  # same round size as generate_qkd_key_bb84
+    return eve_rate, key_size, n_qubits, simulate_qber_batch(rounds, n_qubits, eve_rate, seed)
+
+def calibrate_qber_thresholds(eve_rates=(0.0, 0.05, 0.1, 0.2, 0.3, 0.5, 1.0), key_sizes=(256,), rounds=1000, thresholds=None, workers=1, seed=None, bins=50):  # monte carlo sweep of qber against the detector cut offs
+    thresholds = thresholds or {"secure": QBER_SECURE_THRESHOLD, "alert": QBER_ALERT_THRESHOLD}
+    seeds = np.random.SeedSequence(seed).spawn(len(eve_rates) * len(key_sizes))
+    grid = [(float(r), int(k), rounds, s) for (r, k), s in zip([(r, k) for r in eve_rates for k in key_sizes], seeds)]
+    if workers and workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            cells = list(pool.map(_sweep_cell, grid))
+    else:
+        cells = [_sweep_cell(args) for args in grid]
+    results = []
+    for eve_rate, key_size, n_qubits, qbers in cells:
+        counts, edges = np.histogram(qbers, bins=bins, range=(0.0, 0.5))
+        rates = {}
+        for name, cut in thresholds.items():
+            alarm = float(np.mean(qbers >= cut))
+            rates[name] = {"threshold": cut, "false_alarm_rate": alarm} if eve_rate == 0 else {"threshold": cut, "miss_rate": 1.0 - alarm}
+        results.append({
+            "eve_rate": eve_rate,
+            "key_size": key_size,
+            "n_qubits": n_qubits,
+            "rounds": rounds,
+            "qber_mean": float(np.mean(qbers)),
+            "qber_std": float(np.std(qbers)),
+            "qber_percentiles": {str(p): float(q) for p, q in zip((1, 5, 50, 95, 99), np.percentile(qbers, (1, 5, 50, 95, 99)))},
+            "histogram": {"counts": counts.tolist(), "edges": edges.tolist()},
+            "rates": rates,
+        })
+    return {"ok": True, "thresholds": thresholds, "results": results}
+
+def _audit_chunk(chunk):  # check one chunk of (pid, threshold, count, packed) as stacked arrays
+    flagged = {}
+    groups = {}
+    for pid, threshold, count, packed in chunk:
+        values = np.frombuffer(packed, dtype="<u2")
+        if count == 0 or values.size == 0:
+            flagged[pid] = ["no_shares"]
+        elif values.size % count or values.size // count < 3:
+            flagged[pid] = ["malformed_shares"]
+        else:
+            groups.setdefault((count, values.size // count), []).append((pid, threshold, values))
+    for (count, width), items in groups.items():
+        stack = np.stack([values for _, _, values in items]).reshape(len(items), count, width).astype(np.int64)
+        flags = _share_flags(stack[:, :, 0], stack[:, :, 1:], [threshold for _, threshold, _ in items])
+        names = list(flags)
+        hits = np.column_stack([flags[name] for name in names])
+        for i in np.flatnonzero(hits.any(axis=1)):
+            flagged[items[i][0]] = [names[j] for j in np.flatnonzero(hits[i])]
+    return len(chunk), flagged
+
+def audit_share_store(chunk_size=10000, workers=1):  # stream the whole share store and report patients whose shares look tampered
+    scanned, flagged = 0, {}
+    def collect(result):
+        nonlocal scanned
+        scanned += result[0]
+        flagged.update(result[1])
+    chunks = iter_packed_shares(chunk_size)
+    if workers and workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+            for chunk in chunks:
+                pending.append(pool.submit(_audit_chunk, chunk))
+                if len(pending) >= 2 * workers:  # bounded number of chunks in flight
+                    collect(pending.popleft().result())
+            while pending:
+                collect(pending.popleft().result())
+    else:
+        for chunk in chunks:
+            collect(_audit_chunk(chunk))
+    return {"ok": True, "scanned": scanned, "flagged_count": len(flagged), "flagged": flagged}
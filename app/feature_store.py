@@ -0,0 +1,101 @@
+import os
+import hashlib
+import threading
+import numpy as np
+
+DATA_DIR = os.environ.get("QSH_DATA_DIR", os.path.join(os.path.dirname(__file__), "data"))  # app data folder, overridable for isolated runs
+FEATURES_PATH = os.path.join(DATA_DIR, "features.bin")  # append only journal of fixed width feature rows
+ROW_DTYPE = np.dtype([("pid", "S64"), ("deleted", "u1"), ("age", "<i4"), ("systolic", "<i4"), ("diastolic", "<i4"), ("cholesterol", "<i4"), ("label", "u1")])
+COMPACT_MIN_ROWS = 1024  # journals shorter than this are never compacted
+COMPACT_RATIO = 2.0  # compact when the journal holds this many rows per live patient
+READ_ONLY = False  # set in worker processes, only the process that appends may rebuild or compact the journal
+
+_lock = threading.Lock()
+
+def _pid_key(pid) -> bytes:  # fixed width key, long ids are hashed to fit
+    raw = str(pid).encode("utf-8")
+    return raw if len(raw) <= 64 else hashlib.sha256(raw).hexdigest().encode("ascii")
+
+def _row(pid, patient) -> tuple:  # parse one patient into a feature row, tombstone if it cannot be parsed
+    from app.ml_model import _parse_bp, _assign_label  # local import to avoid cycles
+    try:
+        systolic, diastolic = _parse_bp(patient.get("blood_pressure", "0 0"))
+        return (_pid_key(pid), 0, int(patient.get("age", 0)), systolic, diastolic, int(patient.get("cholesterol", 0)), _assign_label(patient))
+    except Exception:
+        return (_pid_key(pid), 1, 0, 0, 0, 0, 0)
+
+def _append(rows: list):  # one write per call so concurrent appenders do not interleave rows
+    if not rows:
+        return
+    table = np.array(rows, dtype=ROW_DTYPE)
+    with _lock:
+        if not os.path.exists(FEATURES_PATH):
+            _rebuild_locked()  # journal must start from the full store before taking deltas
+        with open(FEATURES_PATH, "ab") as f:
+            f.write(table.tobytes())
+
+def upsert(pid, patient: dict):  # record new or changed features of one patient
+    _append([_row(pid, patient)])
+
+def upsert_many(items):  # record features of many (pid, patient) pairs with one append
+    _append([_row(pid, patient) for pid, patient in items])
+
+def remove(pid):  # tombstone a deleted patient
+    _append([(_pid_key(pid), 1, 0, 0, 0, 0, 0)])
+
+def clear():  # empty journal after a reset of the stores
+    with _lock:
+        open(FEATURES_PATH, "wb").close()
+
+def _write_rows(rows: np.ndarray):  # replace the journal atomically
+    tmp = f"{FEATURES_PATH}.{os.getpid()}.{threading.get_ident()}.tmp"
+    rows.tofile(tmp)
+    os.replace(tmp, FEATURES_PATH)
+
+def _store_rows() -> np.ndarray:  # feature rows computed from the decrypted store
+    from app.storage import load_decrypted_patients  # local import to avoid cycles
+    patients = load_decrypted_patients()
+    return np.array([_row(pid, p) for pid, p in patients.items()], dtype=ROW_DTYPE)
+
+def _rebuild_locked():
+    _write_rows(_store_rows())
+
+def _read_rows() -> np.ndarray:  # whole rows only, a row another process is appending right now is left for the next read
+    with open(FEATURES_PATH, "rb") as f:
+        data = f.read()
+    return np.frombuffer(data[:len(data) - len(data) % ROW_DTYPE.itemsize], dtype=ROW_DTYPE)
+
+def rebuild():  # rebuild the journal from the decrypted store, e.g. after editing data outside the app
+    with _lock:
+        _rebuild_locked()
+
+def _live_rows() -> np.ndarray:  # latest row per patient without tombstones, in first seen order
+    with _lock:
+        if not os.path.exists(FEATURES_PATH):
+            if READ_ONLY:
+                rows = _store_rows()  # build in memory, the owning process creates the journal
+            else:
+                _rebuild_locked()
+                rows = _read_rows()
+        else:
+            rows = _read_rows()
+        if rows.size == 0:
+            return rows
+        _, first = np.unique(rows["pid"], return_index=True)
+        _, last_rev = np.unique(rows["pid"][::-1], return_index=True)
+        latest = rows[rows.size - 1 - last_rev][np.argsort(first)]
+        live = latest[latest["deleted"] == 0]
+        if not READ_ONLY and rows.size >= COMPACT_MIN_ROWS and rows.size > COMPACT_RATIO * max(1, live.size):
+            _write_rows(live)  # drop superseded rows and tombstones
+        return live
+
+def load_features() -> dict:  # feature columns ready for training, no per patient parsing
+    live = _live_rows()
+    return {
+        "pids": live["pid"],
+        "age": live["age"],
+        "systolic": live["systolic"],
+        "diastolic": live["diastolic"],
+        "cholesterol": live["cholesterol"],
+        "label": live["label"].astype(np.int64),
+    }
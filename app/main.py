@@ -1,3 +1,4 @@
+from app.detector import audit_share_store
 from app.orchestrator import (
     register_patient,
     reconstruct_key_wrapper,
@@ -21,6 +22,7 @@ def menu():  # simple cli menu
         print("6 Delete patient data")  # delete
         print("7 Reset all data")  # reset
         print("8 Preload demo dataset and train")  # preload
+        print("9 Audit share store")  # audit
         print("0 Exit")  # exit
         choice = input("Select ")  # read choice
 
@@ -71,6 +73,10 @@ def menu():  # simple cli menu
             res = preload_demo_dataset()
             print(res)
 
+        elif choice == "9":
+            res = audit_share_store()
+            print(res)
+
         elif choice == "0":
             break
 
@@ -0,0 +1,186 @@
+import os
+import json
+import time
+import threading
+from bisect import bisect_left
+from typing import Dict, List, Optional
+
+ENABLED = os.environ.get("QSH_METRICS", "0").lower() in ("1", "true", "yes", "on")  # instrumentation is off unless asked for
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)  # histogram upper bounds in seconds
+PREFIX = "qsh"  # metric name prefix for the prometheus export
+
+_lock = threading.Lock()
+_histograms: Dict[str, "_Histogram"] = {}  # stage name -> latency histogram
+_counters: Dict[str, float] = {}  # counter name -> value
+
+class _Histogram:  # cumulative bucket counts, sum and count like a prometheus histogram
+    __slots__ = ("counts", "total", "count", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # last slot is +Inf
+        self.total = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q: float) -> float:  # bucket upper bound that covers quantile q
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(BUCKETS, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return self.max
+
+class _Timer:  # context manager that records elapsed time into a stage histogram
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe(self.name, time.perf_counter() - self.start)
+        if exc_type is not None:
+            inc(self.name + ".error")
+        return False
+
+class _NoopTimer:  # shared do nothing timer handed out while disabled
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NOOP = _NoopTimer()
+
+def enable():  # turn instrumentation on at runtime
+    global ENABLED
+    ENABLED = True
+
+def disable():  # turn instrumentation off, recorded values are kept
+    global ENABLED
+    ENABLED = False
+
+def is_enabled() -> bool:
+    return ENABLED
+
+def timer(name: str):  # with timer("register.qkd_key"): ... , near zero cost while disabled
+    return _Timer(name) if ENABLED else _NOOP
+
+def observe(name: str, seconds: float):  # record one latency sample
+    if not ENABLED:
+        return
+    with _lock:
+        hist = _histograms.get(name)
+        if hist is None:
+            hist = _histograms[name] = _Histogram()
+        hist.observe(seconds)
+
+def inc(name: str, value: float = 1.0):  # bump a counter
+    if not ENABLED:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0.0) + value
+
+def reset():  # drop every recorded value
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+def snapshot() -> dict:  # json friendly view of all stages and counters
+    with _lock:
+        stages = {}
+        for name, hist in sorted(_histograms.items()):
+            stages[name] = {
+                "count": hist.count,
+                "sum_s": round(hist.total, 6),
+                "mean_ms": round(hist.total / hist.count * 1000, 4) if hist.count else 0.0,
+                "p50_ms": round(hist.quantile(0.5) * 1000, 4),
+                "p99_ms": round(hist.quantile(0.99) * 1000, 4),
+                "max_ms": round(hist.max * 1000, 4),
+                "buckets": {str(b): n for b, n in zip(list(BUCKETS) + ["+Inf"], _cumulative(hist.counts))},
+            }
+        return {"enabled": ENABLED, "stages": stages, "counters": dict(sorted(_counters.items()))}
+
+def _cumulative(counts: List[int]) -> List[int]:
+    out, running = [], 0
+    for n in counts:
+        running += n
+        out.append(running)
+    return out
+
+def _label(value: str) -> str:  # escape a label value for the text format
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def prometheus_text() -> str:  # render everything in the prometheus text exposition format
+    with _lock:
+        hists = sorted((name, list(h.counts), h.total, h.count) for name, h in _histograms.items())
+        counters = sorted(_counters.items())
+    lines = [f"# HELP {PREFIX}_stage_seconds Latency of instrumented pipeline stages.", f"# TYPE {PREFIX}_stage_seconds histogram"]
+    for name, counts, total, count in hists:
+        stage = _label(name)
+        for bound, n in zip(list(BUCKETS) + ["+Inf"], _cumulative(counts)):
+            lines.append(f"{PREFIX}_stage_seconds_bucket{{stage=\"{stage}\",le=\"{bound}\"}} {n}")
+        lines.append(f"{PREFIX}_stage_seconds_sum{{stage=\"{stage}\"}} {total:.9f}")
+        lines.append(f"{PREFIX}_stage_seconds_count{{stage=\"{stage}\"}} {count}")
+    lines += [f"# HELP {PREFIX}_events_total Counted pipeline events.", f"# TYPE {PREFIX}_events_total counter"]
+    for name, value in counters:
+        lines.append(f"{PREFIX}_events_total{{event=\"{_label(name)}\"}} {value:g}")
+    return "\n".join(lines) + "\n"
+
+def write_json(path: str) -> str:  # dump the snapshot to a file for offline inspection
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(snapshot(), f, indent=2)
+    return path
+
+_server = None  # running http server, if any
+
+def serve(port: int = 9108, host: str = "127.0.0.1"):  # expose /metrics (prometheus) and /metrics.json on a local daemon thread
+    global _server
+    if _server is not None:
+        return _server
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # local import, only needed when serving
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.startswith("/metrics.json"):
+                body, ctype = json.dumps(snapshot()).encode("utf-8"), "application/json"
+            elif self.path.startswith("/metrics"):
+                body, ctype = prometheus_text().encode("utf-8"), "text/plain; version=0.0.4"
+            else:
+                self.send_response(404)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):  # keep the console quiet
+            pass
+
+    _server = ThreadingHTTPServer((host, port), _Handler)
+    threading.Thread(target=_server.serve_forever, name="qsh-metrics", daemon=True).start()
+    return _server
+
+def stop_server(server: Optional[object] = None):  # shut down the metrics endpoint
+    global _server
+    server = server or _server
+    if server is not None:
+        server.shutdown()
+        server.server_close()
+    if server is _server:
+        _server = None
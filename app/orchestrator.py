@@ -1,43 +1,117 @@
+import os
 import json
-from app.data_generator import input_patient_data  # interactive input function
-from app.storage import save_patient, load_record, delete_patient, reset_all, reconstruct_key, unlock_patient, load_decrypted_patients, load_shares  # storage functions
+from app.data_generator import input_patient_data, generate_patients, chunked  # patient input and synthetic cohorts
+from app.storage import save_patient, save_patients, load_record, delete_patient, reset_all, reconstruct_key, unlock_patient, unlock_patients, load_decrypted_patients, load_decrypted_patient, load_shares, batch as storage_batch  # storage functions
 from app.qkd import generate_qkd_key  # qkd key generator
 from app.smpc import share_secret  # secret sharing
 from app.detector import detect_attack  # attack detector
-from app.ml_model import train_model as model_train, predict as predict_patient_risk  # ml functions
+from app.ml_model import train_model as model_train, predict as predict_patient_risk, predict_many as predict_patients_risk  # ml functions
+from app import metrics  # stage timers and counters
+from app.cache import BoundedCache  # bounded lru and ttl cache
 
-_unlocked_keys_cache = {}  # cache for unlocked keys
-_unlocked_patients_cache = {}  # cache for decrypted patient data
+CACHE_MAX_ENTRIES = int(os.environ.get("QSH_CACHE_MAX_ENTRIES", "10000"))  # most unlocked patients held in memory
+CACHE_MAX_BYTES = int(os.environ.get("QSH_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))  # byte budget for decrypted patients
+CACHE_TTL = float(os.environ.get("QSH_CACHE_TTL", "900"))  # seconds before an unlocked key or patient is forgotten
+
+_unlocked_keys_cache = BoundedCache(max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL, name="unlocked_keys")  # cache for unlocked keys
+_unlocked_patients_cache = BoundedCache(max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES, ttl=CACHE_TTL, name="unlocked_patients")  # cache for decrypted patient data
 
 def register_patient(pid, name, age, condition, bp, chol, num_shares=5, threshold=3):  # register patient flow
     try:
-        existing = load_record(pid)  # check duplicate
-        if existing:
-            return {"error": "already registered"}  # duplicate error
+        with metrics.timer("register.total"):
+            existing = load_record(pid)  # cheap early exit, the save repeats the check atomically
+            if existing:
+                metrics.inc("register.duplicate")
+                return {"error": "already registered"}  # duplicate error
+            if threshold > num_shares:
+                return {"error": "threshold cannot be greater than total shares"}  # threshold invalid
+            with metrics.timer("register.qkd_key"):
+                key_hex = generate_qkd_key()  # generate key
+            with metrics.timer("register.share_secret"):
+                shares = share_secret(key_hex, num_shares, threshold)  # create shares
+            with metrics.timer("register.detect_attack"):
+                attack_detected = detect_attack(shares)  # check shares integrity
+            patient = {"patient_id": pid, "name": name, "age": age, "condition": condition, "blood_pressure": bp, "cholesterol": chol, "key_hex": key_hex}
+            with metrics.timer("register.save"):
+                saved = save_patient(pid, patient, key_hex, shares, threshold, skip_existing=True)  # save everything unless a concurrent registration won
+            if not saved:
+                metrics.inc("register.duplicate")
+                return {"error": "already registered"}  # another session registered this pid first
+            _unlocked_keys_cache[pid] = key_hex  # cache key for demo use
+            _unlocked_patients_cache[pid] = patient  # cache patient
+            metrics.inc("register.ok")
+            return {"ok": True, "patient_id": pid, "key_hex_for_demo": key_hex, "threshold": threshold, "attack_detected": attack_detected}
+    except Exception as e:
+        metrics.inc("register.error")
+        return {"error": str(e) or "Unknown error"}
+
+def register_patients_batch(rows, num_shares=5, threshold=3):  # register many (pid, name, age, condition, bp, chol) rows with one storage commit
+    try:
         if threshold > num_shares:
             return {"error": "threshold cannot be greater than total shares"}  # threshold invalid
-        key_hex = generate_qkd_key()  # generate key
-        shares = share_secret(key_hex, num_shares, threshold)  # create shares
-        attack_detected = detect_attack(shares)  # check shares integrity
-        patient = {"patient_id": pid, "name": name, "age": age, "condition": condition, "blood_pressure": bp, "cholesterol": chol, "key_hex": key_hex}
-        save_patient(pid, patient, key_hex, shares, threshold)  # save everything
-        _unlocked_keys_cache[pid] = key_hex  # cache key for demo use
-        _unlocked_patients_cache[pid] = patient  # cache patient
-        return {"ok": True, "patient_id": pid, "key_hex_for_demo": key_hex, "threshold": threshold, "attack_detected": attack_detected}
+        rows = list(rows)
+        with storage_batch():  # one pass over the stores for the early duplicate checks, the save repeats them atomically
+            existing = {row[0] for row in rows if load_record(row[0])}
+        results, entries, positions, seen = [], [], [], set()
+        for pid, name, age, condition, bp, chol in rows:
+            if pid in existing or pid in seen:
+                results.append({"patient_id": pid, "error": "already registered"})  # duplicate error
+                continue
+            seen.add(pid)
+            with metrics.timer("register.qkd_key"):
+                key_hex = generate_qkd_key()  # generate key
+            with metrics.timer("register.share_secret"):
+                shares = share_secret(key_hex, num_shares, threshold)  # create shares
+            with metrics.timer("register.detect_attack"):
+                attack_detected = detect_attack(shares)  # check shares integrity
+            patient = {"patient_id": pid, "name": name, "age": age, "condition": condition, "blood_pressure": bp, "cholesterol": chol, "key_hex": key_hex}
+            entries.append((pid, patient, key_hex, shares, threshold))
+            positions.append(len(results))
+            results.append({"ok": True, "patient_id": pid, "key_hex_for_demo": key_hex, "threshold": threshold, "attack_detected": attack_detected})
+        with metrics.timer("register.save_batch"):
+            saved = {pid for pid, _ in save_patients(entries, skip_existing=True)}  # encrypt and commit all three stores once
+        for i, (pid, patient, key_hex, _, _) in zip(positions, entries):
+            if pid not in saved:
+                results[i] = {"patient_id": pid, "error": "already registered"}  # a concurrent registration won
+                continue
+            _unlocked_keys_cache[pid] = key_hex  # cache key for demo use
+            _unlocked_patients_cache[pid] = patient  # cache patient
+        metrics.inc("register.ok", len(saved))
+        return {"ok": True, "registered": len(saved), "results": results}
     except Exception as e:
-        return {"error": str(e) or "Unknown error"}
+        return {"error": str(e) or "Batch registration failed"}
+
+def load_synthetic_cohort(n, seed=None, chunk_size=1000, num_shares=5, threshold=3, train=True):  # register a seeded synthetic cohort in batches and optionally train on it
+    try:
+        registered = 0
+        for chunk in chunked(generate_patients(n, seed=seed), chunk_size):
+            res = register_patients_batch(chunk, num_shares=num_shares, threshold=threshold)
+            if not res.get("ok"):
+                return res
+            registered += res["registered"]
+        result = {"ok": True, "registered": registered}
+        if train:
+            result["training"] = model_train()
+        return result
+    except Exception as e:
+        return {"error": str(e) or "Synthetic cohort load failed"}
 
 def reconstruct_key_wrapper(pid, num_shares):  # wrapper to reconstruct key
     try:
-        return reconstruct_key(pid, num_shares)
+        with metrics.timer("reconstruct.total"):
+            return reconstruct_key(pid, num_shares)
     except Exception as e:
         return {"ok": False, "error": str(e) or "Error reconstructing key"}
 
 def unlock_patient_with_cache(pid, key_hex):  # unlock patient using cache if possible
     cached_key = _unlocked_keys_cache.get(pid)
-    if cached_key == key_hex and pid in _unlocked_patients_cache:
-        return {"ok": True, "patient": _unlocked_patients_cache[pid]}  # return cached patient
-    res = unlock_patient(pid, key_hex)  # try unlock through storage
+    patient = _unlocked_patients_cache.get(pid) if cached_key == key_hex else None
+    if patient is not None:
+        metrics.inc("unlock.cache_hit")
+        return {"ok": True, "patient": patient}  # return cached patient
+    metrics.inc("unlock.cache_miss")
+    with metrics.timer("unlock.storage"):
+        res = unlock_patient(pid, key_hex)  # try unlock through storage
     if res.get("ok"):
         _unlocked_keys_cache[pid] = key_hex
         _unlocked_patients_cache[pid] = res["patient"]
@@ -48,7 +122,8 @@ def unlock_patient_wrapper(pid, key_hex):  # public wrapper
 
 def train_model():  # train ml model via ml module
     try:
-        return model_train()
+        with metrics.timer("train.total"):
+            return model_train()
     except Exception as e:
         return {"error": str(e) or "Model training failed"}
 
@@ -63,10 +138,62 @@ def predict_risk(pid, key_hex=None):  # predict risk for pid
             patient = _unlocked_patients_cache.get(pid)
             if not patient:
                 return {"ok": False, "error": "Patient not unlocked and no key provided"}
-        return predict_patient_risk(patient)
+        with metrics.timer("predict.model"):
+            return predict_patient_risk(patient)
     except Exception as e:
         return {"ok": False, "error": str(e) or "Prediction failed"}
 
+def predict_many(items, keys=None, from_store=False):  # predict risk for many pids and or patient dicts in one model call, from_store opts in to reading locked pids from the decrypted store
+    try:
+        keys = keys or {}
+        items = list(items)
+        patients = [None] * len(items)
+        errors = {}
+        to_unlock, to_fetch = [], []
+        for i, item in enumerate(items):
+            if isinstance(item, dict):
+                patients[i] = item
+            elif item in keys:
+                if _unlocked_keys_cache.get(item) == keys[item]:
+                    patients[i] = _unlocked_patients_cache.get(item)  # cached unlock
+                if patients[i] is None:
+                    to_unlock.append(i)
+            else:
+                patients[i] = _unlocked_patients_cache.get(item)
+                if patients[i] is None:
+                    if from_store:
+                        to_fetch.append(i)
+                    else:
+                        errors[i] = "Patient not unlocked and no key provided"  # same rule as predict_risk
+        if to_unlock:
+            with metrics.timer("predict_many.unlock"):
+                unlocked = unlock_patients([(items[i], keys[items[i]]) for i in to_unlock])  # one commit for all unlocks
+            for i in to_unlock:
+                res = unlocked[items[i]]
+                if res.get("ok"):
+                    _unlocked_keys_cache[items[i]] = keys[items[i]]
+                    _unlocked_patients_cache[items[i]] = res["patient"]
+                    patients[i] = res["patient"]
+                else:
+                    errors[i] = "Invalid key or patient not found"
+        if to_fetch:
+            with storage_batch():  # one pass over the decrypted store
+                for i in to_fetch:
+                    patients[i] = load_decrypted_patient(items[i])
+                    if not patients[i]:
+                        errors[i] = "Patient not found"
+        ready = [i for i in range(len(items)) if i not in errors]
+        with metrics.timer("predict_many.model"):
+            predictions = dict(zip(ready, predict_patients_risk([patients[i] for i in ready])))
+        results = []
+        for i, item in enumerate(items):
+            pid = item.get("patient_id") if isinstance(item, dict) else item
+            res = {"ok": False, "error": errors[i]} if i in errors else predictions[i]
+            results.append({"patient_id": pid, **res})
+        return {"ok": True, "results": results}
+    except Exception as e:
+        return {"ok": False, "error": str(e) or "Batch prediction failed"}
+
 def delete_patient_wrapper(pid):  # delete patient data
     try:
         _unlocked_keys_cache.pop(pid, None)
@@ -74,11 +201,15 @@ def delete_patient_wrapper(pid):  # delete patient data
         record = load_record(pid)
         if not record:
             return {"error": "not found"}
-        delete_patient(pid)
+        with metrics.timer("delete.storage"):
+            delete_patient(pid)
         return {"ok": True, "message": f"Patient {pid} deleted successfully"}
     except Exception as e:
         return {"error": str(e) or "Deletion failed"}
 
+def cache_stats():  # hit, miss and eviction statistics of the unlock caches
+    return {"keys": _unlocked_keys_cache.stats(), "patients": _unlocked_patients_cache.stats()}
+
 def reset_all_data():  # reset all data and clear caches
     try:
         result = reset_all()
@@ -91,7 +222,6 @@ def reset_all_data():  # reset all data and clear caches
 def preload_demo_dataset():  # create demo patients and train ml model
     try:
         from app.smpc import reconstruct_secret  # local import
-        from app.storage import load_record, load_shares, unlock_patient  # storage helpers
         reset_all()
         _unlocked_keys_cache.clear()
         _unlocked_patients_cache.clear()
@@ -138,16 +268,16 @@ def preload_demo_dataset():  # create demo patients and train ml model
             ("P339", "Patient339", 27, "Asthma", "118 77", 185),
             ("P340", "Patient340", 45, "Healthy", "120 80", 175),
         ]
-        for pid, name, age, cond, bp, chol in demo_patients:
-            register_patient(pid, name, age, cond, bp, chol, num_shares=5, threshold=3)
+        res = register_patients_batch(demo_patients, num_shares=5, threshold=3)
+        if not res.get("ok"):
+            return res
+        pairs = []
         for pid in [f"P{str(i)}" for i in range(300, 341)]:
-            rec = load_record(pid)
-            if rec:
-                meta = load_shares(pid)
-                if meta:
-                    subset = meta["shares"][:meta["threshold"]]
-                    key_hex = reconstruct_secret(subset)
-                    unlock_patient(pid, key_hex)  # write decrypted entry for ml
+            meta = load_shares(pid)
+            if meta:
+                subset = meta["shares"][:meta["threshold"]]
+                pairs.append((pid, reconstruct_secret(subset)))
+        unlock_patients(pairs)  # write decrypted entries for ml in one commit
         model_train()  # train model on demo data
         return {"ok": True, "msg": "Preloaded demo dataset P300 to P340"}
     except Exception as e:
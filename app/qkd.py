@@ -1,5 +1,9 @@
 import os
+import queue
 import secrets
+import threading
+import time
+import numpy as np
 from typing import List, Dict, Tuple
 
 def _rand_bits(n: int) -> List[int]:  # random bits from os entropy
@@ -57,7 +61,56 @@ def _sift_and_qber(alice_bits, alice_bases, bob_results, bob_bases):
     qber = mismatches / len(sifted_a)
     return sifted_a, qber
 
-def generate_qkd_key_bb84(bits_needed: int = 256, allow_eavesdrop: bool = False, eve_rate: float = 0.0) -> Dict:
+def _rand_bits_np(n: int) -> np.ndarray:  # random bits from os entropy as a uint8 array
+    raw = np.frombuffer(os.urandom((n + 7) // 8), dtype=np.uint8)
+    return np.unpackbits(raw, bitorder="little")[:n]
+
+def _bb84_sim_np(n_bits: int, eve: bool, eve_rate: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:  # one bb84 round with every qubit handled as an array op
+    alice_bits = _rand_bits_np(n_bits)
+    alice_bases = _rand_bits_np(n_bits)
+    bob_bases = _rand_bits_np(n_bits)
+    effective_bits = alice_bits.copy()
+    if eve and eve_rate > 0:
+        draws = np.frombuffer(os.urandom(4 * n_bits), dtype=np.uint32) % 10000
+        intercepted = draws < int(eve_rate * 10000)
+        eve_bases = _rand_bits_np(n_bits)
+        flips = intercepted & (eve_bases != alice_bases) & (_rand_bits_np(n_bits) == 1)
+        effective_bits ^= flips.astype(np.uint8)
+    bob_results = np.where(bob_bases == alice_bases, effective_bits, _rand_bits_np(n_bits))
+    return alice_bits, alice_bases, bob_results, bob_bases
+
+def _sift_and_qber_np(alice_bits, alice_bases, bob_results, bob_bases) -> Tuple[np.ndarray, float]:
+    keep = alice_bases == bob_bases
+    sifted_a = alice_bits[keep]
+    if sifted_a.size == 0:
+        return sifted_a, 1.0
+    qber = float(np.count_nonzero(sifted_a != bob_results[keep])) / sifted_a.size
+    return sifted_a, qber
+
+def _to_hex_np(bits: np.ndarray) -> str:  # pack bits to hex, same bit order as _to_hex
+    return np.packbits(bits, bitorder="little").tobytes().hex()
+
+def simulate_qber_batch(rounds: int, n_qubits: int, eve_rate: float = 0.0, seed=None) -> np.ndarray:  # qber of many independent bb84 rounds as one 2d computation
+    rng = np.random.default_rng(seed)  # monte carlo only, keys never come from this generator
+    block = max(1, (1 << 22) // max(1, n_qubits))  # rows per block to bound memory
+    out = np.empty(rounds, dtype=np.float64)
+    for start in range(0, rounds, block):
+        shape = (min(block, rounds - start), n_qubits)
+        alice_bits = rng.integers(0, 2, size=shape, dtype=np.uint8)
+        alice_bases = rng.integers(0, 2, size=shape, dtype=np.uint8)
+        bob_bases = rng.integers(0, 2, size=shape, dtype=np.uint8)
+        effective_bits = alice_bits
+        if eve_rate > 0:
+            intercepted = rng.random(shape) < eve_rate
+            flips = intercepted & (rng.integers(0, 2, size=shape, dtype=np.uint8) != alice_bases) & (rng.integers(0, 2, size=shape, dtype=np.uint8) == 1)
+            effective_bits = alice_bits ^ flips.astype(np.uint8)
+        keep = alice_bases == bob_bases  # bob's random results on other bases are sifted away
+        errors = np.count_nonzero(keep & (effective_bits != alice_bits), axis=1)
+        sifted = np.count_nonzero(keep, axis=1)
+        out[start:start + shape[0]] = np.where(sifted > 0, errors / np.maximum(sifted, 1), 1.0)
+    return out
+
+def _generate_bb84_python(bits_needed: int, allow_eavesdrop: bool, eve_rate: float) -> Dict:  # reference list based engine
     sifted = []
     total_qber_samples = []
     while len(sifted) < bits_needed:
@@ -71,6 +124,111 @@ def generate_qkd_key_bb84(bits_needed: int = 256, allow_eavesdrop: bool = False,
     avg_qber = sum(total_qber_samples) / max(1, len(total_qber_samples))
     return {"key_hex": key_hex, "qber": avg_qber, "sifted_len": len(sifted)}
 
+def _generate_bb84_numpy(bits_needed: int, allow_eavesdrop: bool, eve_rate: float) -> Dict:  # vectorized engine
+    rounds = []
+    total_qber_samples = []
+    sifted_len = 0
+    while sifted_len < bits_needed:
+        a_bits, a_bases, b_bits, b_bases = _bb84_sim_np(max(4 * bits_needed, 1024), allow_eavesdrop, eve_rate)
+        round_sifted, qber = _sift_and_qber_np(a_bits, a_bases, b_bits, b_bases)
+        if round_sifted.size:
+            total_qber_samples.append(qber)
+            rounds.append(round_sifted)
+            sifted_len += round_sifted.size
+    key_bits = np.concatenate(rounds)[:bits_needed]
+    key_hex = _to_hex_np(key_bits)
+    avg_qber = sum(total_qber_samples) / max(1, len(total_qber_samples))
+    return {"key_hex": key_hex, "qber": avg_qber, "sifted_len": sifted_len}
+
+def generate_qkd_key_bb84(bits_needed: int = 256, allow_eavesdrop: bool = False, eve_rate: float = 0.0, engine: str = "numpy") -> Dict:
+    if engine == "python":
+        return _generate_bb84_python(bits_needed, allow_eavesdrop, eve_rate)
+    return _generate_bb84_numpy(bits_needed, allow_eavesdrop, eve_rate)
+
+class KeyPool:  # bounded reservoir of pre generated bb84 keys refilled by a background thread
+    def __init__(self, size: int = 256, low_watermark: int = None, refill_rate: float = 0.0, bits_needed: int = 256):
+        self.size = size
+        self.low_watermark = size // 4 if low_watermark is None else low_watermark
+        self.refill_rate = refill_rate  # max keys per second, 0 means as fast as possible
+        self.bits_needed = bits_needed
+        self._queue = queue.Queue(maxsize=size)
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "generated": 0}
+        self._thread = None
+
+    def _count(self, name: str):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _generate(self) -> Dict:
+        return generate_qkd_key_bb84(bits_needed=self.bits_needed, allow_eavesdrop=False, eve_rate=0.0)
+
+    def _run(self):  # fill to capacity, then sleep until the level drops to the watermark
+        while not self._stop.is_set():
+            while not self._queue.full() and not self._stop.is_set():
+                self._queue.put(self._generate())
+                self._count("generated")
+                if self.refill_rate > 0:
+                    time.sleep(1.0 / self.refill_rate)
+            self._wake.wait(timeout=1.0)
+            self._wake.clear()
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="qkd-key-pool", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self._thread = None
+
+    def get(self) -> Dict:  # take a key in O(1), generating one synchronously when the pool is empty
+        try:
+            res = self._queue.get_nowait()
+            self._count("hits")
+        except queue.Empty:
+            res = self._generate()
+            self._count("misses")
+        if self._queue.qsize() <= self.low_watermark:
+            self._wake.set()
+        return res
+
+    def stats(self) -> Dict:
+        with self._lock:
+            counters = dict(self._counters)
+        return {"size": self.size, "available": self._queue.qsize(), "low_watermark": self.low_watermark, "refill_rate": self.refill_rate, "running": self._thread is not None and self._thread.is_alive(), **counters}
+
+_key_pool = None  # active key pool, none means synchronous generation
+
+def start_key_pool(size: int = 256, low_watermark: int = None, refill_rate: float = 0.0) -> Dict:  # enable background key generation
+    global _key_pool
+    if _key_pool is not None:
+        _key_pool.stop()
+    _key_pool = KeyPool(size=size, low_watermark=low_watermark, refill_rate=refill_rate).start()
+    return _key_pool.stats()
+
+def stop_key_pool() -> Dict:  # disable the pool and go back to synchronous generation
+    global _key_pool
+    pool, _key_pool = _key_pool, None
+    if pool is None:
+        return {"ok": True, "running": False}
+    pool.stop()
+    return pool.stats()
+
+def key_pool_stats() -> Dict:  # pool level and hit or miss counters
+    return _key_pool.stats() if _key_pool is not None else {"running": False}
+
+def take_qkd_key() -> Dict:  # key with its qber, from the pool when enabled
+    if _key_pool is not None:
+        return _key_pool.get()
+    return generate_qkd_key_bb84(bits_needed=256, allow_eavesdrop=False, eve_rate=0.0)
+
 def generate_qkd_key() -> str:  # simple wrapper for compatibility
-    res = generate_qkd_key_bb84(bits_needed=256, allow_eavesdrop=False, eve_rate=0.0)
-    return res["key_hex"]
+    return take_qkd_key()["key_hex"]
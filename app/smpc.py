@@ -1,21 +1,28 @@
-import random
+import os
+from functools import lru_cache
+import numpy as np
 from typing import List, Dict
 
 PRIME = 257  # prime for byte arithmetic
+LAGRANGE_CACHE_SIZE = 1024  # distinct x tuples whose lagrange weights are kept
 
-def _eval_poly(coeffs, x, p):  # evaluate polynomial at x modulo p
-    result = 0
-    power = 1
-    for c in coeffs:
-        result = (result + c * power) % p
-        power = (power * x) % p
-    return result
+def _rand_coeffs(shape, p):  # uniform coefficients in 0..p-1 from os entropy
+    count = int(np.prod(shape))
+    return (np.frombuffer(os.urandom(4 * count), dtype=np.uint32) % p).astype(np.int64).reshape(shape)
 
-def _lagrange_at_zero(x_s: List[int], y_s: List[int], p: int) -> int:  # lagrange interpolation at zero
-    total = 0
+def _vandermonde(x_s: List[int], degree: int, p: int) -> np.ndarray:  # rows are powers 0..degree-1 of each x modulo p
+    xs = np.asarray(x_s, dtype=np.int64) % p
+    rows = np.ones((degree, len(xs)), dtype=np.int64)
+    for i in range(1, degree):
+        rows[i] = (rows[i - 1] * xs) % p
+    return rows
+
+@lru_cache(maxsize=LAGRANGE_CACHE_SIZE)
+def _lagrange_weights(x_s: tuple, p: int) -> np.ndarray:  # weights w_i so that f(0) = sum w_i y_i modulo p, memoized per x tuple
     k = len(x_s)
+    weights = np.empty(k, dtype=np.int64)
     for i in range(k):
-        xi, yi = x_s[i], y_s[i]
+        xi = x_s[i]
         num, den = 1, 1
         for j in range(k):
             if j == i:
@@ -23,37 +30,27 @@ def _lagrange_at_zero(x_s: List[int], y_s: List[int], p: int) -> int:  # lagrang
             xj = x_s[j]
             num = (num * (-xj)) % p
             den = (den * (xi - xj)) % p
-        inv_den = pow(den, -1, p)
-        total += yi * num * inv_den
-        total %= p
-    return total
+        weights[i] = (num * pow(den, -1, p)) % p
+    weights.flags.writeable = False  # shared by every caller of the cache
+    return weights
 
 def share_secret(secret_hex: str, num_shares: int = 5, threshold: int = 3) -> List[Dict]:  # create secret shares
     secret_bytes = bytes.fromhex(secret_hex)
     if threshold < 2 or threshold > num_shares:
         raise ValueError("threshold must be between 2 and num_shares")
-    coeffs_per_byte = []
-    for byte in secret_bytes:
-        coeffs = [byte] + [random.randint(0, PRIME - 1) for _ in range(threshold - 1)]
-        coeffs_per_byte.append(coeffs)
-    shares = []
-    for x in range(1, num_shares + 1):
-        share_bytes = []
-        for coeffs in coeffs_per_byte:
-            value = _eval_poly(coeffs, x, PRIME)
-            share_bytes.append(value)
-        shares.append({"x": x, "share": share_bytes})
-    return shares  # list of share dicts
+    coeffs = _rand_coeffs((len(secret_bytes), threshold), PRIME)  # one polynomial per byte
+    coeffs[:, 0] = np.frombuffer(secret_bytes, dtype=np.uint8)  # constant term is the secret byte
+    x_s = list(range(1, num_shares + 1))
+    values = (coeffs @ _vandermonde(x_s, threshold, PRIME)) % PRIME  # bytes x shares
+    return [{"x": x, "share": values[:, i].tolist()} for i, x in enumerate(x_s)]  # list of share dicts
 
 def reconstruct_secret(shares: List[Dict]) -> str:  # reconstruct secret hex from shares
     if not shares:
         raise ValueError("No shares provided")
-    x_s = [share["x"] for share in shares]
-    share_lists = [share["share"] for share in shares]
-    length = len(share_lists[0])
-    recovered = bytearray()
-    for pos in range(length):
-        y_s = [sl[pos] for sl in share_lists]
-        val = _lagrange_at_zero(x_s, y_s, PRIME)
-        recovered.append(val % 256)
-    return recovered.hex()  # return hex string
+    x_s = tuple(int(share["x"]) for share in shares)
+    ys = np.array([share["share"] for share in shares], dtype=np.int64)  # shares x bytes
+    recovered = (_lagrange_weights(x_s, PRIME) @ ys) % PRIME
+    return (recovered % 256).astype(np.uint8).tobytes().hex()  # return hex string
+
+def lagrange_cache_info():  # hit and miss counters of the weight cache
+    return _lagrange_weights.cache_info()
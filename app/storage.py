@@ -1,13 +1,30 @@
 import os
 import json
-from typing import Dict, List
+import base64
+import time
+import queue
+import atexit
+import sqlite3
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+import numpy as np
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from app import feature_store
+from app import metrics  # stage timers and counters
 
 BASE_DIR = os.path.dirname(__file__)  # path of this file
-DATA_DIR = os.path.join(BASE_DIR, "data")  # data folder inside app
+DATA_DIR = os.environ.get("QSH_DATA_DIR", os.path.join(BASE_DIR, "data"))  # data folder inside app, overridable for isolated runs
 RECORDS_PATH = os.path.join(DATA_DIR, "records.json")  # encrypted records file
 SHARES_PATH = os.path.join(DATA_DIR, "shares.json")  # secret shares file
 DECRYPTED_PATH = os.path.join(DATA_DIR, "decrypted_patients.json")  # decrypted data for ml
+DB_PATH = os.path.join(DATA_DIR, "store.db")  # sqlite store used by default
+STORAGE_BACKEND = os.environ.get("QSH_STORAGE_BACKEND", "sqlite")  # sqlite or json
+SINGLE_WRITER = os.environ.get("QSH_SINGLE_WRITER", "1") != "0"  # route every mutation through one writer thread
+COMMIT_WINDOW = float(os.environ.get("QSH_COMMIT_WINDOW_MS", "0")) / 1000.0  # extra time the writer waits to grow a group, 0 commits whatever is queued
+COMMIT_MAX_OPS = int(os.environ.get("QSH_COMMIT_MAX_OPS", "512"))  # most queued writes folded into one commit
+FSYNC = os.environ.get("QSH_FSYNC", "0") == "1"  # fsync json files and run sqlite with synchronous=FULL
 os.makedirs(DATA_DIR, exist_ok=True)  # create data folder if missing
 
 def _load_json(path: str) -> dict:  # helper to load json files
@@ -19,46 +36,516 @@ def _load_json(path: str) -> dict:  # helper to load json files
         except Exception:
             return {}
 
-def _save_json(path: str, data: dict):  # helper to save json files
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2)
+def _save_json(path: str, data: dict, fsync: Optional[bool] = None):  # atomic save through a temp file and rename so readers never see a partial file
+    fsync = FSYNC if fsync is None else fsync
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, separators=(",", ":"))
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp, path)
+    if fsync and hasattr(os, "O_DIRECTORY"):
+        fd = os.open(os.path.dirname(path) or ".", os.O_RDONLY | os.O_DIRECTORY)  # persist the rename itself
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+def _pack_shares(shares: List[Dict]) -> bytes:  # uint16 rows holding x then the share values
+    rows = np.empty((len(shares), len(shares[0]["share"]) + 1), dtype="<u2")
+    rows[:, 0] = [share["x"] for share in shares]
+    rows[:, 1:] = np.asarray([share["share"] for share in shares])
+    return rows.tobytes()
+
+def _unpack_shares(packed: bytes, count: int) -> List[Dict]:  # share dicts viewing the packed buffer, no per byte ints
+    rows = np.frombuffer(packed, dtype="<u2").reshape(count, -1)
+    return [{"x": int(row[0]), "share": row[1:]} for row in rows]
+
+def _record_to_json(blob: dict) -> dict:  # base64 record for the json backend
+    return {"nonce_b64": base64.b64encode(blob["nonce"]).decode(), "ciphertext_b64": base64.b64encode(blob["ciphertext"]).decode()}
+
+def _record_from_json(blob: dict) -> dict:  # accepts base64 and the older hex layout
+    if "nonce_b64" in blob:
+        return {"nonce": base64.b64decode(blob["nonce_b64"]), "ciphertext": base64.b64decode(blob["ciphertext_b64"])}
+    return {"nonce": bytes.fromhex(blob["nonce_hex"]), "ciphertext": bytes.fromhex(blob["ciphertext_hex"])}
+
+def _shares_to_json(meta: dict) -> dict:  # packed base64 shares for the json backend
+    return {"threshold": meta["threshold"], "count": len(meta["shares"]), "packed_b64": base64.b64encode(_pack_shares(meta["shares"])).decode()}
+
+def _shares_from_json(meta: dict) -> dict:  # accepts packed shares and the older per byte lists
+    if "packed_b64" in meta:
+        return {"threshold": meta["threshold"], "shares": _unpack_shares(base64.b64decode(meta["packed_b64"]), meta["count"])}
+    return meta
+
+class JsonBackend:  # original layout with one json file per store
+    def __init__(self, records_path: str = RECORDS_PATH, shares_path: str = SHARES_PATH, decrypted_path: str = DECRYPTED_PATH):
+        self.paths = {"records": records_path, "shares": shares_path, "decrypted": decrypted_path}
+        self._pending = None  # in memory stores while a batch is open
+        self._owner = None  # thread that opened the batch, the only one allowed to see _pending
+        self._dirty = set()  # stores changed inside the open batch
+        self._lock = threading.RLock()
+
+    def _own_pending(self) -> Optional[dict]:  # open batch of the calling thread, other threads read the committed files
+        pending = self._pending
+        return pending if pending is not None and self._owner == threading.get_ident() else None
+
+    def _get(self, store: str, patient_id: str):
+        pending = self._own_pending()
+        if pending is not None:
+            return pending[store].get(patient_id)
+        return _load_json(self.paths[store]).get(patient_id)
+
+    def _put(self, store: str, patient_id: str, value):
+        with self._lock:
+            if self._pending is not None:
+                self._pending[store][patient_id] = value
+                self._dirty.add(store)
+                return
+            data = _load_json(self.paths[store])
+            data[patient_id] = value
+            _save_json(self.paths[store], data)
+
+    def get_record(self, patient_id: str) -> Optional[dict]:
+        blob = self._get("records", patient_id)
+        return _record_from_json(blob) if blob else None
+
+    def get_records(self, patient_ids: List[str]) -> Dict[str, dict]:  # many records from one read of the file
+        pending = self._own_pending()
+        data = pending["records"] if pending is not None else _load_json(self.paths["records"])
+        return {pid: _record_from_json(data[pid]) for pid in patient_ids if data.get(pid)}
+
+    def get_shares(self, patient_id: str) -> Optional[dict]:
+        meta = self._get("shares", patient_id)
+        return _shares_from_json(meta) if meta else None
+
+    def get_decrypted(self, patient_id: str) -> Optional[dict]:
+        return self._get("decrypted", patient_id)
+
+    def all_decrypted(self) -> dict:
+        pending = self._own_pending()
+        if pending is not None:
+            return dict(pending["decrypted"])
+        return _load_json(self.paths["decrypted"])
+
+    def iter_packed_shares(self, chunk_size: int):  # chunks of (pid, threshold, count, packed) from the shares file
+        chunk = []
+        pending = self._own_pending()
+        for pid, meta in (pending["shares"] if pending is not None else _load_json(self.paths["shares"])).items():
+            if "packed_b64" in meta:
+                chunk.append((pid, meta["threshold"], meta["count"], base64.b64decode(meta["packed_b64"])))
+            else:
+                shares = meta.get("shares", [])
+                chunk.append((pid, meta.get("threshold", 2), len(shares), _pack_shares(shares) if shares else b""))
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def put_record(self, patient_id: str, blob: dict):
+        self._put("records", patient_id, _record_to_json(blob))
+
+    def put_shares(self, patient_id: str, meta: dict):
+        self._put("shares", patient_id, _shares_to_json(meta))
+
+    def put_decrypted(self, patient_id: str, patient: dict):
+        self._put("decrypted", patient_id, patient)
+
+    def delete(self, patient_id: str):
+        with self._lock:
+            for store, path in self.paths.items():
+                if self._pending is not None:
+                    if self._pending[store].pop(patient_id, None) is not None:
+                        self._dirty.add(store)
+                    continue
+                data = _load_json(path)
+                if patient_id in data:
+                    del data[patient_id]
+                    _save_json(path, data)
+
+    def clear(self):
+        with self._lock:
+            for store, path in self.paths.items():
+                if self._pending is not None:
+                    self._pending[store] = {}
+                    self._dirty.add(store)
+                else:
+                    _save_json(path, {})
+
+    @contextmanager
+    def batch(self):  # load each file once and write each changed file once on exit
+        with self._lock:
+            if self._pending is not None:  # nested batch joins the outer one
+                yield self
+                return
+            self._pending = {store: _load_json(path) for store, path in self.paths.items()}
+            self._owner = threading.get_ident()
+            self._dirty = set()
+            try:
+                yield self
+                for store, path in self.paths.items():
+                    if store in self._dirty:  # read only batches write nothing
+                        _save_json(path, self._pending[store])
+            finally:
+                self._pending = None
+                self._owner = None
+                self._dirty = set()
+
+class SqliteBackend:  # indexed store so single patient reads and writes do not touch the whole cohort
+    def __init__(self, db_path: str = DB_PATH):
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        self._depth = 0  # open batch depth
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL" if FSYNC else "PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS records (pid TEXT PRIMARY KEY, nonce BLOB NOT NULL, ciphertext BLOB NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS shares (pid TEXT PRIMARY KEY, threshold INTEGER NOT NULL, count INTEGER NOT NULL, packed BLOB NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS decrypted (pid TEXT PRIMARY KEY, patient TEXT NOT NULL);"
+        )
+
+    def _one(self, sql: str, params: tuple):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchone()
+
+    def _write(self, sql: str, params: tuple):
+        with self._lock:
+            self._conn.execute(sql, params)
+
+    def get_record(self, patient_id: str) -> Optional[dict]:
+        row = self._one("SELECT nonce, ciphertext FROM records WHERE pid = ?", (patient_id,))
+        return {"nonce": bytes(row[0]), "ciphertext": bytes(row[1])} if row else None
+
+    def get_records(self, patient_ids: List[str]) -> Dict[str, dict]:  # many records with chunked plain selects, no write transaction
+        found = {}
+        ids = list(dict.fromkeys(patient_ids))
+        for start in range(0, len(ids), 500):  # stays under the sqlite bound parameter limit
+            chunk = ids[start:start + 500]
+            with self._lock:
+                rows = self._conn.execute(f"SELECT pid, nonce, ciphertext FROM records WHERE pid IN ({','.join('?' * len(chunk))})", chunk).fetchall()
+            for pid, nonce, ciphertext in rows:
+                found[pid] = {"nonce": bytes(nonce), "ciphertext": bytes(ciphertext)}
+        return found
+
+    def get_shares(self, patient_id: str) -> Optional[dict]:
+        row = self._one("SELECT threshold, count, packed FROM shares WHERE pid = ?", (patient_id,))
+        return {"threshold": row[0], "shares": _unpack_shares(row[2], row[1])} if row else None
+
+    def get_decrypted(self, patient_id: str) -> Optional[dict]:
+        row = self._one("SELECT patient FROM decrypted WHERE pid = ?", (patient_id,))
+        return json.loads(row[0]) if row else None
+
+    def all_decrypted(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute("SELECT pid, patient FROM decrypted ORDER BY rowid").fetchall()
+        return {pid: json.loads(patient) for pid, patient in rows}
+
+    def iter_packed_shares(self, chunk_size: int):  # keyset paginated chunks of (pid, threshold, count, packed)
+        last = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute("SELECT rowid, pid, threshold, count, packed FROM shares WHERE rowid > ? ORDER BY rowid LIMIT ?", (last, chunk_size)).fetchall()
+            if not rows:
+                return
+            last = rows[-1][0]
+            yield [(pid, threshold, count, bytes(packed)) for _, pid, threshold, count, packed in rows]
+
+    def put_record(self, patient_id: str, blob: dict):
+        self._write("INSERT OR REPLACE INTO records VALUES (?, ?, ?)", (patient_id, blob["nonce"], blob["ciphertext"]))
+
+    def put_shares(self, patient_id: str, meta: dict):
+        self._write("INSERT OR REPLACE INTO shares VALUES (?, ?, ?, ?)", (patient_id, int(meta["threshold"]), len(meta["shares"]), _pack_shares(meta["shares"])))
+
+    def put_decrypted(self, patient_id: str, patient: dict):
+        self._write("INSERT OR REPLACE INTO decrypted VALUES (?, ?)", (patient_id, json.dumps(patient, separators=(",", ":"))))
+
+    def delete(self, patient_id: str):
+        with self.batch():
+            for table in ("records", "shares", "decrypted"):
+                self._conn.execute(f"DELETE FROM {table} WHERE pid = ?", (patient_id,))
+
+    def clear(self):
+        with self.batch():
+            for table in ("records", "shares", "decrypted"):
+                self._conn.execute(f"DELETE FROM {table}")
+
+    @contextmanager
+    def batch(self):  # one transaction for everything written inside the block
+        with self._lock:
+            if self._depth:
+                self._depth += 1
+                try:
+                    yield self
+                finally:
+                    self._depth -= 1
+                return
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._depth = 1
+            try:
+                yield self
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            else:
+                self._conn.execute("COMMIT")
+            finally:
+                self._depth = 0
+
+    def is_migrated(self) -> bool:
+        return self._one("SELECT value FROM meta WHERE key = 'migrated_from_json'", ()) is not None
+
+    def migrate_from_json(self, records_path: str = RECORDS_PATH, shares_path: str = SHARES_PATH, decrypted_path: str = DECRYPTED_PATH) -> dict:  # one shot import of the old json files
+        if self.is_migrated():
+            return {"ok": True, "migrated": 0, "message": "Already migrated"}
+        records, shares, decrypted = _load_json(records_path), _load_json(shares_path), _load_json(decrypted_path)
+        with self.batch():
+            for pid, blob in records.items():
+                self.put_record(pid, _record_from_json(blob))
+            for pid, meta in shares.items():
+                self.put_shares(pid, _shares_from_json(meta))
+            for pid, patient in decrypted.items():
+                self.put_decrypted(pid, patient)
+            self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('migrated_from_json', ?)", (str(len(records)),))
+        return {"ok": True, "migrated": len(records)}
+
+_backend = None  # active storage backend
+_backend_lock = threading.Lock()
 
-def save_patient(patient_id: str, patient_data: dict, key_hex: str, shares: List[Dict], threshold: int):  # save and encrypt patient
+def set_backend(backend):  # plug in a backend object, mainly for tests and tools
+    global _backend
+    _backend = backend
+    return backend
+
+def get_backend():  # return the active backend creating it on first use
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if STORAGE_BACKEND == "json":
+                    _backend = JsonBackend()
+                elif STORAGE_BACKEND == "sqlite":
+                    backend = SqliteBackend()
+                    backend.migrate_from_json()  # no op once the json files were imported
+                    _backend = backend
+                else:
+                    raise ValueError(f"Unknown storage backend {STORAGE_BACKEND}")
+    return _backend
+
+def migrate_json_to_sqlite(db_path: str = DB_PATH) -> dict:  # explicit one shot migration entry point
+    return SqliteBackend(db_path).migrate_from_json()
+
+def _encrypt_patient(patient_data: dict, key_hex: str) -> dict:  # aes-gcm encrypt patient into a record blob
     aes = AESGCM(bytes.fromhex(key_hex))  # create aesgcm cipher from key
     nonce = os.urandom(12)  # random nonce
     plaintext = json.dumps(patient_data, separators=(",", ":"), sort_keys=True).encode()  # serialize patient
     ciphertext = aes.encrypt(nonce, plaintext, associated_data=None)  # encrypt data
+    return {"nonce": nonce, "ciphertext": ciphertext}
+
+_local = threading.local()  # per thread depth of open storage.batch() blocks
+
+@contextmanager
+def batch():  # group storage reads and writes so they are committed once
+    backend = get_backend()
+    _local.depth = getattr(_local, "depth", 0) + 1
+    try:
+        with backend.batch():
+            yield backend
+    finally:
+        _local.depth -= 1
+
+_STOP = object()  # queue sentinel that shuts the writer down
+
+class _Write:  # one queued mutation, apply runs inside the group transaction and after runs once it is committed
+    __slots__ = ("apply", "after", "future")
+
+    def __init__(self, apply: Callable, after: Optional[Callable], future: Future):
+        self.apply = apply
+        self.after = after
+        self.future = future
+
+class StorageWriter:  # single writer thread that folds queued mutations into one commit per group
+    def __init__(self, window: float = COMMIT_WINDOW, max_ops: int = COMMIT_MAX_OPS):
+        self.window = window
+        self.max_ops = max_ops
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {"commits": 0, "writes": 0, "largest_group": 0}
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="qsh-storage-writer", daemon=True)
+                self._thread.start()
+        return self
+
+    def is_writer_thread(self) -> bool:
+        return threading.current_thread() is self._thread
+
+    def submit(self, apply: Callable, after: Optional[Callable] = None) -> Future:  # queue a mutation, the future resolves once it is committed
+        future = Future()
+        self.start()
+        self._queue.put(_Write(apply, after, future))
+        return future
+
+    def _collect(self, first) -> tuple:  # first item plus whatever else is queued now or within the window
+        group, stop = [], first is _STOP
+        if not stop:
+            group.append(first)
+        deadline = time.monotonic() + self.window
+        while not stop and len(group) < self.max_ops:
+            try:
+                timeout = deadline - time.monotonic()
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                stop = True
+            else:
+                group.append(item)
+        return group, stop
+
+    def _run(self):
+        while True:
+            group, stop = self._collect(self._queue.get())
+            if group:
+                self._commit(group)
+            if stop:
+                return
+
+    def _commit(self, group: List[_Write]):  # apply a whole group in one transaction, falling back to one transaction per write if any fails
+        with metrics.timer("storage.group_commit"):
+            try:
+                with get_backend().batch() as backend:
+                    results = [(write, write.apply(backend), None) for write in group]
+            except Exception:
+                results = []
+                for write in group:  # isolate the failing write so the rest still commit
+                    try:
+                        with get_backend().batch() as backend:
+                            results.append((write, write.apply(backend), None))
+                    except Exception as e:
+                        results.append((write, None, e))
+        self._stats["commits"] += 1
+        self._stats["writes"] += len(group)
+        self._stats["largest_group"] = max(self._stats["largest_group"], len(group))
+        metrics.inc("storage.group_commits")
+        metrics.inc("storage.group_writes", len(group))
+        for write, result, error in results:
+            if error is None and write.after is not None:
+                try:
+                    write.after(result)
+                except Exception as e:
+                    error = e
+            if error is None:
+                write.future.set_result(result)
+            else:
+                write.future.set_exception(error)
+
+    def flush(self, timeout: Optional[float] = None):  # wait until everything queued so far is committed
+        self.submit(lambda backend: None).result(timeout)
+
+    def stop(self, timeout: Optional[float] = None):  # commit what is queued and end the thread
+        with self._lock:
+            thread = self._thread
+        if thread is not None and thread.is_alive():
+            self._queue.put(_STOP)
+            thread.join(timeout)
+
+    def stats(self) -> dict:
+        return {**self._stats, "queued": self._queue.qsize()}
+
+_writer = None  # shared writer, created on first write
+_writer_lock = threading.Lock()
+
+def get_writer() -> StorageWriter:
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = StorageWriter()
+    return _writer
 
-    records = _load_json(RECORDS_PATH)  # load existing records
-    records[patient_id] = {"nonce_hex": nonce.hex(), "ciphertext_hex": ciphertext.hex()}  # store encrypted blob
-    _save_json(RECORDS_PATH, records)  # save records
-
-    shares_store = _load_json(SHARES_PATH)  # load shares file
-    shares_store[patient_id] = {"threshold": threshold, "shares": shares}  # add shares metadata
-    _save_json(SHARES_PATH, shares_store)  # save shares
-
-    decrypted = _load_json(DECRYPTED_PATH)  # load decrypted store for ml
-    decrypted[patient_id] = {
-        "patient_id": patient_id,
-        "name": patient_data.get("name", ""),
-        "age": patient_data.get("age", ""),
-        "condition": patient_data.get("condition", ""),
-        "blood_pressure": patient_data.get("blood_pressure", ""),
-        "cholesterol": patient_data.get("cholesterol", "")
-    }  # minimal decrypted fields
-    _save_json(DECRYPTED_PATH, decrypted)  # save decrypted file
+def stop_writer():  # flush pending writes and stop the writer thread
+    if _writer is not None:
+        _writer.stop()
+
+def flush_writes():  # block until every queued write is committed
+    if _writer is not None:
+        _writer.flush()
+
+atexit.register(stop_writer)
+
+def _apply_now(apply: Callable, after: Optional[Callable]) -> Future:  # run a mutation on the calling thread
+    future = Future()
+    try:
+        with get_backend().batch() as backend:
+            result = apply(backend)
+        if after is not None:
+            after(result)
+        future.set_result(result)
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+def submit_write(apply: Callable, after: Optional[Callable] = None) -> Future:  # queue apply(backend) for the next group commit
+    if not SINGLE_WRITER or getattr(_local, "depth", 0) or (_writer is not None and _writer.is_writer_thread()):
+        return _apply_now(apply, after)  # inside an open batch the caller already holds the store, queueing would deadlock
+    return get_writer().submit(apply, after)
+
+def save_patient(patient_id: str, patient_data: dict, key_hex: str, shares: List[Dict], threshold: int, skip_existing: bool = False) -> bool:  # save and encrypt patient, false when skip_existing found it already stored
+    return bool(save_patients([(patient_id, patient_data, key_hex, shares, threshold)], skip_existing))
+
+def save_patients(entries: List[tuple], skip_existing: bool = False) -> List[tuple]:  # save many (patient_id, patient_data, key_hex, shares, threshold) in one commit, returns the saved (pid, minimal) pairs
+    future = submit_save_patients(entries, skip_existing)
+    with metrics.timer("storage.write"):
+        return future.result()
+
+def _update_features(decrypted: List[tuple]):  # keep training features in step with the decrypted store
+    with metrics.timer("storage.feature_store"):
+        feature_store.upsert_many(decrypted)
+
+def submit_save_patients(entries: List[tuple], skip_existing: bool = False) -> Future:  # encrypt on the calling thread and queue the writes, resolves to the saved (pid, minimal) pairs once committed
+    with metrics.timer("storage.encrypt"):
+        blobs = [_encrypt_patient(patient_data, key_hex) for _, patient_data, key_hex, _, _ in entries]  # encrypt before taking the write lock
+    rows = []
+    for (patient_id, patient_data, _, shares, threshold), blob in zip(entries, blobs):
+        minimal = {
+            "patient_id": patient_id,
+            "name": patient_data.get("name", ""),
+            "age": patient_data.get("age", ""),
+            "condition": patient_data.get("condition", ""),
+            "blood_pressure": patient_data.get("blood_pressure", ""),
+            "cholesterol": patient_data.get("cholesterol", "")
+        }  # minimal decrypted fields
+        rows.append((patient_id, blob, {"threshold": threshold, "shares": shares}, minimal))
+
+    def apply(backend):
+        saved = []
+        for patient_id, blob, meta, minimal in rows:
+            if skip_existing and backend.get_record(patient_id):
+                continue  # checked inside the commit so two concurrent registrations cannot both win
+            backend.put_record(patient_id, blob)  # store encrypted blob
+            backend.put_shares(patient_id, meta)  # add shares metadata
+            backend.put_decrypted(patient_id, minimal)
+            saved.append((patient_id, minimal))
+        return saved
+    return submit_write(apply, _update_features)
 
 def load_record(patient_id: str) -> dict:  # load encrypted record
-    return _load_json(RECORDS_PATH).get(patient_id)
+    return get_backend().get_record(patient_id)
 
 def load_shares(patient_id: str) -> dict:  # load shares metadata
-    return _load_json(SHARES_PATH).get(patient_id)
+    return get_backend().get_shares(patient_id)
 
 def reconstruct_key(patient_id: str, use_first_k: int) -> dict:  # reconstruct key from shares
-    container = _load_json(SHARES_PATH)  # read shares file
-    if patient_id not in container:
+    with metrics.timer("storage.load_shares"):
+        meta = load_shares(patient_id)  # read shares of this patient only
+    if not meta:
         return {"ok": False, "error": "No shares found for patient"}  # missing shares
-    meta = container[patient_id]
     shares_all = meta.get("shares", [])
     threshold = meta.get("threshold", 2)
     if use_first_k < threshold:
@@ -67,41 +554,69 @@ def reconstruct_key(patient_id: str, use_first_k: int) -> dict:  # reconstruct k
         return {"ok": False, "error": "use_first_k exceeds available shares"}  # check available shares
     subset = shares_all[:use_first_k]  # take first k shares
     from app.smpc import reconstruct_secret  # local import to avoid cycles
-    key_hex = reconstruct_secret(subset)  # reconstruct secret hex
+    with metrics.timer("storage.reconstruct_secret"):
+        key_hex = reconstruct_secret(subset)  # reconstruct secret hex
     return {"ok": True, "key_hex": key_hex}  # return key
 
+def _decrypt_record(blob: dict, key_hex: str) -> dict:  # aes-gcm decrypt a record blob into the patient dict
+    key = bytes.fromhex(key_hex)  # key bytes
+    aes = AESGCM(key)  # aes object
+    plaintext = aes.decrypt(blob["nonce"], blob["ciphertext"], associated_data=None)  # decrypt
+    return json.loads(plaintext.decode())  # parse patient json
+
 def unlock_patient(patient_id: str, key_hex: str) -> dict:  # decrypt patient with key
-    records = _load_json(RECORDS_PATH)
-    if patient_id not in records:
-        return {"ok": False, "error": "Patient record not found"}  # not found
-    blob = records[patient_id]
-    try:
-        key = bytes.fromhex(key_hex)  # key bytes
-        aes = AESGCM(key)  # aes object
-        nonce = bytes.fromhex(blob["nonce_hex"])  # nonce bytes
-        ciphertext = bytes.fromhex(blob["ciphertext_hex"])  # ciphertext bytes
-        plaintext = aes.decrypt(nonce, ciphertext, associated_data=None)  # decrypt
-        patient = json.loads(plaintext.decode())  # parse patient json
-
-        decrypted = _load_json(DECRYPTED_PATH)
-        decrypted[patient_id] = patient  # store decrypted for ml
-        _save_json(DECRYPTED_PATH, decrypted)
-        return {"ok": True, "patient": patient}  # return patient
-    except Exception as e:
-        return {"ok": False, "error": f"Invalid key or decryption failed {str(e)}"}  # decrypt error
+    return unlock_patients([(patient_id, key_hex)])[patient_id]
+
+def unlock_patients(pairs: List[tuple]) -> Dict[str, dict]:  # decrypt many (patient_id, key_hex) pairs with one commit
+    return submit_unlock_patients(pairs).result()
+
+def submit_unlock_patients(pairs: List[tuple]) -> Future:  # decrypt on the calling thread and queue the decrypted writes, resolves to the results dict
+    results = {}
+    with metrics.timer("storage.unlock"):
+        with metrics.timer("storage.load_records"):
+            blobs = get_backend().get_records([patient_id for patient_id, _ in pairs])  # plain read, no write lock held while decrypting
+        for patient_id, key_hex in pairs:
+            blob = blobs.get(patient_id)
+            if not blob:
+                results[patient_id] = {"ok": False, "error": "Patient record not found"}  # not found
+                continue
+            try:
+                with metrics.timer("storage.decrypt"):
+                    patient = _decrypt_record(blob, key_hex)
+                results[patient_id] = {"ok": True, "patient": patient}  # return patient
+            except Exception as e:
+                results[patient_id] = {"ok": False, "error": f"Invalid key or decryption failed {str(e)}"}  # decrypt error
+    unlocked = [(pid, res["patient"]) for pid, res in results.items() if res.get("ok")]
+    if not unlocked:
+        future = Future()
+        future.set_result(results)  # nothing to write, failed unlocks never touch the writer
+        return future
+
+    def apply(backend):
+        for patient_id, patient in unlocked:
+            backend.put_decrypted(patient_id, patient)  # store decrypted for ml
+        return results
+
+    def after(_):
+        _update_features(unlocked)
+        from app.ml_model import online_update  # local import to avoid cycles
+        online_update(unlocked)  # only queues, the partial fit runs off the writer thread
+    return submit_write(apply, after)
 
 def load_decrypted_patients() -> dict:  # return decrypted patients for ml
-    return _load_json(DECRYPTED_PATH)
+    return get_backend().all_decrypted()
+
+def load_decrypted_patient(patient_id: str) -> Optional[dict]:  # one decrypted patient
+    return get_backend().get_decrypted(patient_id)
+
+def iter_packed_shares(chunk_size: int = 10000):  # stream the share store without loading it whole
+    return get_backend().iter_packed_shares(chunk_size)
 
 def delete_patient(patient_id: str) -> dict:  # delete patient from all stores
-    for path in [RECORDS_PATH, SHARES_PATH, DECRYPTED_PATH]:
-        data = _load_json(path)
-        if patient_id in data:
-            del data[patient_id]
-            _save_json(path, data)
+    with metrics.timer("storage.delete"):
+        submit_write(lambda backend: backend.delete(patient_id), lambda _: feature_store.remove(patient_id)).result()
     return {"ok": True, "deleted": patient_id}  # deletion done
 
-def reset_all() -> dict:  # clear all files
-    for path in [RECORDS_PATH, SHARES_PATH, DECRYPTED_PATH]:
-        _save_json(path, {})
+def reset_all() -> dict:  # clear all stores
+    submit_write(lambda backend: backend.clear(), lambda _: feature_store.clear()).result()
     return {"ok": True, "message": "All data cleared"}  # return ok
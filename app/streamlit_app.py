@@ -2,9 +2,10 @@ import os
 import streamlit as st
 from app.orchestrator import (
     register_patient, reconstruct_key_wrapper, unlock_patient_wrapper,
-    train_model, predict_risk, delete_patient_wrapper, preload_demo_dataset
+    predict_risk, delete_patient_wrapper, preload_demo_dataset
 )
 from app.storage import load_decrypted_patients
+from app.ml_model import warm_up, schedule_retrain
 
 # APP CONFIGURATION
 st.set_page_config(page_title="Quantum Secure Health Risk Prediction", layout="wide")
@@ -27,6 +28,12 @@ if "key_cache" not in st.session_state:
 if "demo_loaded" not in st.session_state:
     st.session_state.demo_loaded = False  # flag for demo data
 
+@st.cache_resource
+def warm_model():  # load the model once per server process
+    return warm_up()
+
+warm_model()
+
 # SIDEBAR MENU
 menu = st.sidebar.selectbox(
     "Menu",
@@ -171,14 +178,9 @@ elif menu == "Predict Risk":
         else:
             res = predict_risk(pid, use_key)
 
-            if (not res.get("ok")) or ("Model not trained" in str(res.get("risk_label"))):
-                st.warning("Model not ready. Retraining...")
-                train_result = train_model()
-                if train_result.get("ok"):
-                    st.success("Model retrained successfully.")
-                    res = predict_risk(pid, use_key)
-                else:
-                    st.error("Model training failed.")
+            if res.get("ok") and "fallback" in str(res.get("risk_label")).lower():
+                schedule_retrain()  # no model yet, train it without blocking this page
+                st.info("Model is training in the background. Showing the rule based result for now.")
 
             if res.get("ok"):
                 risk_label = str(res.get("risk_label")).lower()
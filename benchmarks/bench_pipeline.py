@@ -0,0 +1,163 @@
+import sys
+import os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # run from a checkout without installing
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))  # benchmarks folder
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")  # machine specific baseline written by --save-baseline
+DEFAULT_SIZES = [1000, 10000, 100000]  # cohort sizes from the scaling plan
+STAGES = ["register", "reconstruct", "unlock", "train", "predict", "verify_ledger", "delete"]  # pipeline order
+
+def _peak_rss_mb() -> float:  # peak resident set size of this process
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024  # bytes on macos, kilobytes on linux
+
+def _summary(samples, errors, total):  # latency percentiles and throughput for one stage
+    import numpy as np
+    ms = np.asarray(samples, dtype=np.float64) * 1000.0
+    stats = {"count": len(samples), "errors": errors, "total_s": round(total, 4), "throughput_per_s": round(len(samples) / total, 2) if total > 0 else 0.0}
+    if len(samples):
+        p50, p90, p99 = np.percentile(ms, [50, 90, 99])
+        stats.update({"p50_ms": round(float(p50), 4), "p90_ms": round(float(p90), 4), "p99_ms": round(float(p99), 4), "max_ms": round(float(ms.max()), 4)})
+    return stats
+
+def _timed(fn, items):  # call fn on every item, return per call latencies and the failure count
+    samples, errors = [], 0
+    start = time.perf_counter()
+    for item in items:
+        t0 = time.perf_counter()
+        res = fn(item)
+        samples.append(time.perf_counter() - t0)
+        if not isinstance(res, dict) or res.get("error") or res.get("ok") is False:
+            errors += 1
+    return samples, errors, time.perf_counter() - start
+
+def run_size(n: int, sample: int, seed: int) -> dict:  # drive the orchestrator over one cohort, expects QSH_DATA_DIR to point at an empty dir
+    from app import orchestrator, ledger
+    from app.data_generator import generate_patients
+    rows = list(generate_patients(n, seed=seed))
+    stages = {}
+
+    def register(row):  # one registration plus its ledger event
+        res = orchestrator.register_patient(*row)
+        ledger.record_event("register", {"patient_id": row[0]})
+        return res
+    stages["register"] = _summary(*_timed(register, rows))
+
+    step = max(1, n // max(1, sample))
+    pids = [row[0] for row in rows[::step]][:sample]  # spread the sample across the cohort
+    keys = {}
+
+    def reconstruct(pid):
+        res = orchestrator.reconstruct_key_wrapper(pid, 3)
+        if res.get("ok"):
+            keys[pid] = res["key_hex"]
+        return res
+    stages["reconstruct"] = _summary(*_timed(reconstruct, pids))
+
+    orchestrator._unlocked_keys_cache.clear()  # force unlocks through storage instead of the registration cache
+    orchestrator._unlocked_patients_cache.clear()
+    stages["unlock"] = _summary(*_timed(lambda pid: orchestrator.unlock_patient_wrapper(pid, keys.get(pid, "")), pids))
+    stages["train"] = _summary(*_timed(lambda _: orchestrator.train_model(), [None]))
+    stages["predict"] = _summary(*_timed(orchestrator.predict_risk, pids))
+    stages["verify_ledger"] = _summary(*_timed(lambda _: ledger.verify_ledger(), [None]))
+    stages["delete"] = _summary(*_timed(orchestrator.delete_patient_wrapper, pids))
+    return {"patients": n, "sample": len(pids), "stages": stages, "peak_rss_mb": round(_peak_rss_mb(), 1)}
+
+def _run_isolated(n: int, sample: int, seed: int, keep: bool = False) -> dict:  # run one size in a fresh process and temp data dir so rss and files do not leak between sizes
+    data_dir = tempfile.mkdtemp(prefix=f"qsh_bench_{n}_")
+    out_path = os.path.join(data_dir, "result.json")
+    env = dict(os.environ, QSH_DATA_DIR=data_dir)
+    try:
+        cmd = [sys.executable, os.path.abspath(__file__), "--worker", str(n), "--sample", str(sample), "--seed", str(seed), "--result", out_path]
+        proc = subprocess.run(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        if proc.returncode != 0 or not os.path.exists(out_path):
+            return {"patients": n, "error": (proc.stderr or "worker failed").strip().splitlines()[-1]}
+        with open(out_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    finally:
+        if not keep:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:  # regressions beyond tolerance on p50, throughput and peak rss
+    regressions = []
+    for size, run in results.get("runs", {}).items():
+        base = baseline.get("runs", {}).get(size)
+        if not base or "stages" not in run or "stages" not in base:
+            continue
+        for stage, now in run["stages"].items():
+            old = base["stages"].get(stage)
+            if not old:
+                continue
+            if old.get("p50_ms") and now.get("p50_ms", 0) > old["p50_ms"] * (1 + tolerance):
+                regressions.append(f"{size} {stage} p50 {old['p50_ms']:.3f}ms -> {now['p50_ms']:.3f}ms")
+            if old.get("throughput_per_s") and now.get("throughput_per_s", 0) < old["throughput_per_s"] * (1 - tolerance):
+                regressions.append(f"{size} {stage} throughput {old['throughput_per_s']:.1f}/s -> {now['throughput_per_s']:.1f}/s")
+        if base.get("peak_rss_mb") and run.get("peak_rss_mb", 0) > base["peak_rss_mb"] * (1 + tolerance):
+            regressions.append(f"{size} peak rss {base['peak_rss_mb']:.1f}MB -> {run['peak_rss_mb']:.1f}MB")
+    return regressions
+
+def _print_table(results: dict):  # human readable summary
+    print(f"{'size':>8} {'stage':<14}{'count':>8}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'ops/s':>12}{'errors':>8}")
+    for size, run in results["runs"].items():
+        if "error" in run:
+            print(f"{size:>8} failed: {run['error']}")
+            continue
+        for stage in STAGES:
+            s = run["stages"][stage]
+            print(f"{size:>8} {stage:<14}{s['count']:>8}{s.get('p50_ms', 0):>10.3f}{s.get('p90_ms', 0):>10.3f}{s.get('p99_ms', 0):>10.3f}{s['throughput_per_s']:>12.1f}{s['errors']:>8}")
+        print(f"{size:>8} peak rss {run['peak_rss_mb']:.1f} MB")
+
+def main():
+    parser = argparse.ArgumentParser(description="End to end register, reconstruct, unlock, predict benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="cohort sizes to run")
+    parser.add_argument("--sample", type=int, default=1000, help="patients per size used for reconstruct, unlock, predict and delete")
+    parser.add_argument("--seed", type=int, default=7, help="synthetic cohort seed")
+    parser.add_argument("--output", default=None, help="write results json here")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline json to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown before flagging")
+    parser.add_argument("--fail-on-regression", action="store_true", help="exit non zero when a regression is flagged")
+    parser.add_argument("--keep-data", action="store_true", help="keep the temp data dirs for inspection")
+    parser.add_argument("--worker", type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--result", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:  # child process, QSH_DATA_DIR is already set by the parent
+        result = run_size(args.worker, args.sample, args.seed)
+        with open(args.result, "w", encoding="utf-8") as f:
+            json.dump(result, f)
+        return 0
+
+    results = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": sys.version.split()[0], "platform": sys.platform, "runs": {}}
+    for n in args.sizes:
+        results["runs"][str(n)] = _run_isolated(n, args.sample, args.seed, keep=args.keep_data)
+    _print_table(results)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"baseline saved to {args.baseline}")
+        return 0
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if not regressions:
+            print(f"no regressions against {args.baseline} at {args.tolerance:.0%} tolerance")
+        if regressions and args.fail_on_regression:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,28 @@
+import sys
+import os
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # run from a checkout without installing
+from app.qkd import generate_qkd_key_bb84
+
+def keys_per_second(engine: str, seconds: float = 2.0, **kwargs) -> float:  # generate keys in a loop for a fixed wall time
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        generate_qkd_key_bb84(engine=engine, **kwargs)
+        count += 1
+    return count / (time.perf_counter() - start)
+
+def main():
+    cases = [
+        ("256 bit no eve", {"bits_needed": 256}),
+        ("256 bit eve 0.3", {"bits_needed": 256, "allow_eavesdrop": True, "eve_rate": 0.3}),
+        ("1024 bit no eve", {"bits_needed": 1024}),
+    ]
+    print(f"{'case':<18}{'python keys/s':>16}{'numpy keys/s':>16}{'speedup':>10}")
+    for name, kwargs in cases:
+        before = keys_per_second("python", **kwargs)
+        after = keys_per_second("numpy", **kwargs)
+        print(f"{name:<18}{before:>16.1f}{after:>16.1f}{after / before:>9.1f}x")
+
+if __name__ == "__main__":
+    main()